@@ -1,26 +1,33 @@
 #!/usr/bin/env python3
 import argparse
+import contextlib
+import functools
 import json
+import math
+import os
+import select
 import socket
 import sys
+import tempfile
 import time
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "interop"))
+from slipstream_net import parse_hostport, resolve  # noqa: E402
 
-def parse_hostport(value: str):
-    if value.startswith("["):
-        end = value.find("]")
-        if end == -1:
-            raise ValueError("invalid IPv6 address, missing closing bracket")
-        host = value[1:end]
-        rest = value[end + 1 :]
-        if not rest.startswith(":"):
-            raise ValueError("missing port for IPv6 address")
-        port = int(rest[1:])
-        return host, port
-    if ":" not in value:
-        raise ValueError("missing port (expected host:port)")
-    host, port_str = value.rsplit(":", 1)
-    return host, int(port_str)
+
+PAGE_SIZE = 1 << 20
+
+
+@functools.lru_cache(maxsize=None)
+def fill_page(fill: bytes) -> bytes:
+    return fill * PAGE_SIZE
+
+
+def payload_chunk(fill: bytes, size: int) -> memoryview:
+    # Chunks up to PAGE_SIZE are read-only views of one shared page per fill byte.
+    if size <= PAGE_SIZE:
+        return memoryview(fill_page(fill))[:size]
+    return memoryview(fill * size)
 
 
 def open_log(path: str):
@@ -29,11 +36,119 @@ def open_log(path: str):
     return open(path, "w", encoding="utf-8")
 
 
+def apply_socket_options(sock: socket.socket, args: argparse.Namespace) -> None:
+    # Buffer sizes must be set before connect/listen to affect the negotiated window scale.
+    if args.so_rcvbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, args.so_rcvbuf)
+    if args.so_sndbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, args.so_sndbuf)
+    if args.nodelay:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def connect(host: str, port: int, args: argparse.Namespace) -> socket.socket:
+    error = None
+    for family, type_, proto, _, sockaddr in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM):
+        sock = socket.socket(family, type_, proto)
+        try:
+            apply_socket_options(sock, args)
+            sock.settimeout(args.timeout)
+            sock.connect(sockaddr)
+            return sock
+        except OSError as exc:
+            error = exc
+            sock.close()
+    raise error if error is not None else OSError(f"no addresses for {host}:{port}")
+
+
+@contextlib.contextmanager
+def corked(sock: socket.socket):
+    # Hold partial segments while chunks are queued so the kernel can build full-size
+    # GSO batches; uncorking flushes the tail. No-op where TCP_CORK is unavailable.
+    cork = getattr(socket, "TCP_CORK", None)
+    if cork is None:
+        yield
+        return
+    sock.setsockopt(socket.IPPROTO_TCP, cork, 1)
+    try:
+        yield
+    finally:
+        sock.setsockopt(socket.IPPROTO_TCP, cork, 0)
+
+
+def open_zero_payload(size: int):
+    # Sparse file of zeros; socket.sendfile() needs a regular file, so /dev/zero will not do.
+    payload = tempfile.TemporaryFile()
+    os.ftruncate(payload.fileno(), size)
+    return payload
+
+
 def log_event(log_fp, event: dict) -> None:
     log_fp.write(json.dumps(event) + "\n")
     log_fp.flush()
 
 
+def recv_payload(sock: socket.socket, chunk_size: int, limit: int):
+    """
+    Receive until EOF or until `limit` bytes (0 = no limit) have arrived.
+    Returns (total, first_payload_ts, start) where start is a perf_counter() value.
+    """
+    buf = bytearray(chunk_size)
+    recv_into = sock.recv_into
+    total = recv_into(buf)
+    if not total:
+        return 0, None, None
+    first_payload_ts = time.time()
+    start = time.perf_counter()
+    target = limit if limit else math.inf
+    while total < target:
+        received = recv_into(buf)
+        if not received:
+            break
+        total += received
+    return total, first_payload_ts, start
+
+
+def splice_payload(sock: socket.socket, chunk_size: int, limit: int):
+    """
+    Same contract as recv_payload, but moves bytes socket -> pipe -> /dev/null with
+    splice(2) so the payload never crosses into userspace. Linux only.
+    """
+    read_fd, write_fd = os.pipe()
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    timeout = sock.gettimeout()
+    timeout_ms = None if timeout is None else int(timeout * 1000)
+    poller = select.poll()
+    poller.register(sock, select.POLLIN)
+    fd = sock.fileno()
+    total = 0
+    first_payload_ts = None
+    start = None
+    target = limit if limit else math.inf
+    try:
+        while total < target:
+            try:
+                moved = os.splice(fd, write_fd, chunk_size, flags=os.SPLICE_F_MOVE)
+            except BlockingIOError:
+                # Sockets with a timeout are non-blocking underneath; wait like recv() would.
+                if not poller.poll(timeout_ms):
+                    raise socket.timeout("timed out")
+                continue
+            if not moved:
+                break
+            if first_payload_ts is None:
+                first_payload_ts = time.time()
+                start = time.perf_counter()
+            total += moved
+            while moved:
+                moved -= os.splice(read_fd, devnull, moved, flags=os.SPLICE_F_MOVE)
+    finally:
+        os.close(devnull)
+        os.close(read_fd)
+        os.close(write_fd)
+    return total, first_payload_ts, start
+
+
 def summarize(label: str, total: int, elapsed: float) -> None:
     mib = total / (1024 * 1024)
     mib_s = mib / elapsed if elapsed > 0 else 0.0
@@ -41,17 +156,24 @@ def summarize(label: str, total: int, elapsed: float) -> None:
 
 
 def run_server(args: argparse.Namespace) -> int:
-    host, port = parse_hostport(args.listen)
+    family, sockaddr = resolve(args.listen)
     log_fp = open_log(args.log)
     mode = args.mode
     if mode not in ("sink", "source"):
         raise ValueError("mode must be sink or source")
 
-    with socket.create_server((host, port)) as server:
+    with socket.socket(family, socket.SOCK_STREAM) as server:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # Accepted connections inherit the listener's buffer sizes.
+        apply_socket_options(server, args)
+        server.bind(sockaddr)
+        server.listen()
         server.settimeout(args.timeout)
         log_event(log_fp, {"ts": time.time(), "event": "listening", "listen": args.listen, "mode": mode})
         conn, addr = server.accept()
         with conn:
+            if args.nodelay:
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             conn.settimeout(args.timeout)
             peer = f"{addr[0]}:{addr[1]}"
             log_event(log_fp, {"ts": time.time(), "event": "accept", "peer": peer, "mode": mode})
@@ -60,35 +182,35 @@ def run_server(args: argparse.Namespace) -> int:
             first_payload_ts = None
             last_payload_ts = None
             if mode == "sink":
-                while True:
-                    data = conn.recv(args.chunk_size)
-                    if not data:
-                        break
-                    if first_payload_ts is None:
-                        first_payload_ts = time.time()
-                        start = time.perf_counter()
-                    total += len(data)
-                    last_payload_ts = time.time()
-                    if args.bytes and total >= args.bytes:
-                        break
+                receive = splice_payload if args.zero_copy and hasattr(os, "splice") else recv_payload
+                total, first_payload_ts, start = receive(conn, args.chunk_size, args.bytes)
             else:
                 remaining_preface = args.preface_bytes
+                buf = bytearray(args.chunk_size)
                 while remaining_preface > 0:
-                    data = conn.recv(min(args.chunk_size, remaining_preface))
-                    if not data:
+                    received = conn.recv_into(buf, min(args.chunk_size, remaining_preface))
+                    if not received:
                         break
-                    remaining_preface -= len(data)
+                    remaining_preface -= received
                 remaining = args.bytes
-                chunk = b"a" * args.chunk_size
-                while remaining > 0:
-                    send_len = args.chunk_size if remaining > args.chunk_size else remaining
-                    if first_payload_ts is None:
+                if args.sendfile and remaining > 0:
+                    with open_zero_payload(remaining) as payload:
                         first_payload_ts = time.time()
                         start = time.perf_counter()
-                    conn.sendall(chunk[:send_len])
-                    last_payload_ts = time.time()
-                    remaining -= send_len
+                        conn.sendfile(payload, count=remaining)
+                else:
+                    chunk = payload_chunk(b"a", args.chunk_size)
+                    with corked(conn):
+                        while remaining > 0:
+                            send_len = args.chunk_size if remaining > args.chunk_size else remaining
+                            if first_payload_ts is None:
+                                first_payload_ts = time.time()
+                                start = time.perf_counter()
+                            conn.sendall(chunk if send_len == args.chunk_size else chunk[:send_len])
+                            remaining -= send_len
                 total = args.bytes
+            if first_payload_ts is not None:
+                last_payload_ts = time.time()
             elapsed = time.perf_counter() - start if start is not None else 0.0
             log_event(
                 log_fp,
@@ -121,8 +243,7 @@ def run_client(args: argparse.Namespace) -> int:
     if mode not in ("send", "recv"):
         raise ValueError("mode must be send or recv")
 
-    with socket.create_connection((host, port), timeout=args.timeout) as sock:
-        sock.settimeout(args.timeout)
+    with connect(host, port, args) as sock:
         log_event(log_fp, {"ts": time.time(), "event": "connect", "peer": args.connect, "mode": mode})
         total = 0
         start = None
@@ -130,35 +251,34 @@ def run_client(args: argparse.Namespace) -> int:
         last_payload_ts = None
         if mode == "send":
             remaining = args.bytes
-            chunk = b"b" * args.chunk_size
-            while remaining > 0:
-                send_len = args.chunk_size if remaining > args.chunk_size else remaining
-                if first_payload_ts is None:
+            if args.sendfile and remaining > 0:
+                with open_zero_payload(remaining) as payload:
                     first_payload_ts = time.time()
                     start = time.perf_counter()
-                sock.sendall(chunk[:send_len])
-                last_payload_ts = time.time()
-                remaining -= send_len
+                    sock.sendfile(payload, count=remaining)
+            else:
+                chunk = payload_chunk(b"b", args.chunk_size)
+                with corked(sock):
+                    while remaining > 0:
+                        send_len = args.chunk_size if remaining > args.chunk_size else remaining
+                        if first_payload_ts is None:
+                            first_payload_ts = time.time()
+                            start = time.perf_counter()
+                        sock.sendall(chunk if send_len == args.chunk_size else chunk[:send_len])
+                        remaining -= send_len
             total = args.bytes
         else:
             if args.preface_bytes:
                 remaining = args.preface_bytes
-                chunk = b"p" * args.chunk_size
+                chunk = payload_chunk(b"p", args.chunk_size)
                 while remaining > 0:
                     send_len = args.chunk_size if remaining > args.chunk_size else remaining
-                    sock.sendall(chunk[:send_len])
+                    sock.sendall(chunk if send_len == args.chunk_size else chunk[:send_len])
                     remaining -= send_len
-            while True:
-                data = sock.recv(args.chunk_size)
-                if not data:
-                    break
-                if first_payload_ts is None:
-                    first_payload_ts = time.time()
-                    start = time.perf_counter()
-                total += len(data)
-                last_payload_ts = time.time()
-                if args.bytes and total >= args.bytes:
-                    break
+            receive = splice_payload if args.zero_copy and hasattr(os, "splice") else recv_payload
+            total, first_payload_ts, start = receive(sock, args.chunk_size, args.bytes)
+        if first_payload_ts is not None:
+            last_payload_ts = time.time()
         elapsed = time.perf_counter() - start if start is not None else 0.0
         log_event(
             log_fp,
@@ -198,6 +318,30 @@ def main() -> int:
     server_parser.add_argument("--timeout", type=float, default=30)
     server_parser.add_argument("--preface-bytes", type=int, default=0)
     server_parser.add_argument("--linger-secs", type=float, default=0)
+    server_parser.add_argument(
+        "--so-rcvbuf",
+        type=int,
+        default=0,
+        help="SO_RCVBUF in bytes (default: kernel autotuning; capped by net.core.rmem_max)",
+    )
+    server_parser.add_argument(
+        "--so-sndbuf",
+        type=int,
+        default=0,
+        help="SO_SNDBUF in bytes (default: kernel autotuning; capped by net.core.wmem_max)",
+    )
+    server_parser.add_argument("--nodelay", action="store_true", help="set TCP_NODELAY")
+    server_parser.add_argument(
+        "--zero-copy",
+        action="store_true",
+        help="discard received payload with splice(2) instead of recv_into (Linux)",
+    )
+    server_parser.add_argument(
+        "--no-sendfile",
+        dest="sendfile",
+        action="store_false",
+        help="send payload with a chunked sendall loop instead of sendfile",
+    )
     server_parser.add_argument("--log", default="-", help="log file path (default: stdout)")
 
     client_parser = subparsers.add_parser("client", help="run send/recv client")
@@ -208,6 +352,30 @@ def main() -> int:
     client_parser.add_argument("--timeout", type=float, default=30)
     client_parser.add_argument("--preface-bytes", type=int, default=0)
     client_parser.add_argument("--linger-secs", type=float, default=0)
+    client_parser.add_argument(
+        "--so-rcvbuf",
+        type=int,
+        default=0,
+        help="SO_RCVBUF in bytes (default: kernel autotuning; capped by net.core.rmem_max)",
+    )
+    client_parser.add_argument(
+        "--so-sndbuf",
+        type=int,
+        default=0,
+        help="SO_SNDBUF in bytes (default: kernel autotuning; capped by net.core.wmem_max)",
+    )
+    client_parser.add_argument("--nodelay", action="store_true", help="set TCP_NODELAY")
+    client_parser.add_argument(
+        "--zero-copy",
+        action="store_true",
+        help="discard received payload with splice(2) instead of recv_into (Linux)",
+    )
+    client_parser.add_argument(
+        "--no-sendfile",
+        dest="sendfile",
+        action="store_false",
+        help="send payload with a chunked sendall loop instead of sendfile",
+    )
     client_parser.add_argument("--log", default="-", help="log file path (default: stdout)")
 
     args = parser.parse_args()
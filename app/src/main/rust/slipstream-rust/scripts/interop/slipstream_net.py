@@ -0,0 +1,76 @@
+"""
+Address and UDP batching helpers shared by the interop and bench harness scripts.
+"""
+
+import socket
+from typing import List, Tuple
+
+
+def parse_hostport(value: str) -> Tuple[str, int]:
+    if value.startswith("["):
+        end = value.find("]")
+        if end == -1:
+            raise ValueError("invalid IPv6 address, missing closing bracket")
+        host = value[1:end]
+        rest = value[end + 1 :]
+        if not rest.startswith(":"):
+            raise ValueError("missing port for IPv6 address")
+        port = int(rest[1:])
+        return host, port
+    host, sep, port_str = value.rpartition(":")
+    if not sep:
+        raise ValueError("missing port (expected host:port)")
+    return host, int(port_str)
+
+
+def resolve(value: str, type: int = socket.SOCK_STREAM) -> Tuple[int, tuple]:
+    """
+    Parse a listen address host:port (or [v6]:port) and resolve it in one getaddrinfo call.
+    An empty host binds every interface, and IPv4 results are preferred as the stdlib
+    servers did. Returns (family, sockaddr).
+    """
+    host, port = parse_hostport(value)
+    infos = socket.getaddrinfo(host or None, port, type=type, flags=socket.AI_PASSIVE)
+    family, _, _, _, sockaddr = next(
+        (info for info in infos if info[0] == socket.AF_INET), infos[0]
+    )
+    return family, sockaddr
+
+
+class BatchReceiver:
+    """
+    Reads the datagrams waiting on a socket that select() reported readable.
+
+    The first datagram is a plain recvfrom(). Further non-blocking reads are only
+    tried while wakeups keep finding bursts, plus one probe every
+    `probe_interval` wakeups, so a lone request or reply costs no extra syscall.
+    """
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        max_batch: int = 64,
+        bufsize: int = 65535,
+        probe_interval: int = 32,
+    ):
+        self.sock = sock
+        self.max_batch = max_batch
+        self.bufsize = bufsize
+        self.probe_interval = max(1, probe_interval)
+        self._skip = 0
+
+    def receive(self) -> List[Tuple[bytes, tuple]]:
+        """Return the ready (data, addr) pairs; the socket must be readable."""
+        recvfrom = self.sock.recvfrom
+        bufsize = self.bufsize
+        batch = [recvfrom(bufsize)]
+        if self._skip:
+            self._skip -= 1
+            return batch
+        try:
+            while len(batch) < self.max_batch:
+                batch.append(recvfrom(bufsize, socket.MSG_DONTWAIT))
+        except (BlockingIOError, ConnectionRefusedError):
+            pass
+        self._skip = 0 if len(batch) > 1 else self.probe_interval - 1
+        return batch
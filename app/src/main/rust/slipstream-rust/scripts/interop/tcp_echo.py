@@ -1,56 +1,85 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
 import json
-import socketserver
 import sys
 import time
 
+from slipstream_net import resolve
 
-def parse_hostport(value: str):
-    if value.startswith("["):
-        end = value.find("]")
-        if end == -1:
-            raise ValueError("invalid IPv6 address, missing closing bracket")
-        host = value[1:end]
-        rest = value[end + 1 :]
-        if not rest.startswith(":"):
-            raise ValueError("missing port for IPv6 address")
-        port = int(rest[1:])
-        return host, port
-    if ":" not in value:
-        raise ValueError("missing port (expected host:port)")
-    host, port_str = value.rsplit(":", 1)
-    return host, int(port_str)
-
-
-class EchoHandler(socketserver.StreamRequestHandler):
-    def handle(self):
-        server = self.server
-        log_fp = getattr(server, "log_fp", None)
-        peer = f"{self.client_address[0]}:{self.client_address[1]}"
-        if log_fp:
-            log_fp.write(json.dumps({"ts": time.time(), "event": "connect", "peer": peer}) + "\n")
-            log_fp.flush()
-
-        while True:
-            data = self.rfile.read(4096)
-            if not data:
-                break
-            self.wfile.write(data)
-            self.wfile.flush()
-            if log_fp:
-                log_fp.write(
-                    json.dumps({"ts": time.time(), "event": "echo", "peer": peer, "len": len(data)}) + "\n"
-                )
-                log_fp.flush()
-
-        if log_fp:
-            log_fp.write(json.dumps({"ts": time.time(), "event": "disconnect", "peer": peer}) + "\n")
-            log_fp.flush()
-
-
-class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    allow_reuse_address = True
+READ_SIZE = 65536
+
+
+def drain_events(queue: asyncio.Queue) -> list:
+    events = []
+    while not queue.empty():
+        events.append(queue.get_nowait())
+    return events
+
+
+def write_events(log_fp, events: list) -> None:
+    # One write and one flush per batch; the harness greps the log while we run.
+    if events:
+        log_fp.write("".join(json.dumps(event) + "\n" for event in events))
+    log_fp.flush()
+
+
+async def log_writer(log_fp, queue: asyncio.Queue) -> None:
+    # Single consumer: write everything queued since the last wakeup in one batch.
+    while True:
+        events = [await queue.get()]
+        events.extend(drain_events(queue))
+        write_events(log_fp, events)
+
+
+class EchoProto(asyncio.BufferedProtocol):
+    def __init__(self, log_queue: asyncio.Queue):
+        self.log_queue = log_queue
+        self.transport = None
+        self.peer = ""
+        self._buf = bytearray(READ_SIZE)
+        self._view = memoryview(self._buf)
+
+    def connection_made(self, transport):
+        self.transport = transport
+        peername = transport.get_extra_info("peername")
+        self.peer = f"{peername[0]}:{peername[1]}"
+        self.log_queue.put_nowait({"ts": time.time(), "event": "connect", "peer": self.peer})
+
+    def get_buffer(self, sizehint):
+        return self._view
+
+    def buffer_updated(self, nbytes):
+        self.transport.write(self._view[:nbytes])
+        if self.transport.get_write_buffer_size():
+            # The transport may still reference the unsent tail; receive into a new buffer.
+            self._buf = bytearray(READ_SIZE)
+            self._view = memoryview(self._buf)
+        self.log_queue.put_nowait({"ts": time.time(), "event": "echo", "peer": self.peer, "len": nbytes})
+
+    def pause_writing(self):
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.transport.resume_reading()
+
+    def connection_lost(self, exc):
+        self.log_queue.put_nowait({"ts": time.time(), "event": "disconnect", "peer": self.peer})
+
+
+async def serve(family: int, sockaddr: tuple, log_fp) -> None:
+    loop = asyncio.get_running_loop()
+    log_queue: asyncio.Queue = asyncio.Queue()
+    writer_task = asyncio.create_task(log_writer(log_fp, log_queue))
+    server = await loop.create_server(
+        lambda: EchoProto(log_queue), sockaddr[0], sockaddr[1], family=family
+    )
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        writer_task.cancel()
+        write_events(log_fp, drain_events(log_queue))
 
 
 def main() -> int:
@@ -59,18 +88,24 @@ def main() -> int:
     parser.add_argument("--log", default="-", help="log file path (default: stdout)")
     args = parser.parse_args()
 
-    listen = parse_hostport(args.listen)
+    family, sockaddr = resolve(args.listen)
     log_fp = sys.stdout if args.log == "-" else open(args.log, "w", encoding="utf-8")
 
-    with ThreadedTCPServer(listen, EchoHandler) as server:
-        server.log_fp = log_fp
-        try:
-            server.serve_forever()
-        except KeyboardInterrupt:
-            pass
-        finally:
-            if log_fp is not sys.stdout:
-                log_fp.close()
+    try:
+        import uvloop
+    except ImportError:
+        # uvloop is optional; fall back to the default asyncio event loop.
+        pass
+    else:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    try:
+        asyncio.run(serve(family, sockaddr, log_fp))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if log_fp is not sys.stdout:
+            log_fp.close()
 
     return 0
 
@@ -10,37 +10,48 @@ Features:
 """
 
 import argparse
+import binascii
+import bisect
 import heapq
-import json
 import random
+import signal
 import socket
 import sys
 import time
+from collections import deque
+from operator import itemgetter
 from select import select
-from typing import Dict, List, Optional, Tuple
-
-
-def parse_hostport(value: str) -> Tuple[str, int]:
-    if value.startswith("["):
-        end = value.find("]")
-        if end == -1:
-            raise ValueError("invalid IPv6 address")
-        host = value[1:end]
-        rest = value[end + 1 :]
-        if not rest.startswith(":"):
-            raise ValueError("missing port")
-        return host, int(rest[1:])
-    if ":" not in value:
-        raise ValueError("missing port")
-    host, port_str = value.rsplit(":", 1)
-    return host, int(port_str)
-
-
-def addr_to_string(addr: Tuple[str, int]) -> str:
-    host, port = addr
+from typing import Deque, Dict, List, Optional, Tuple
+
+from slipstream_net import BatchReceiver, parse_hostport
+
+# Upper bound on how long a logged packet may sit in the write buffer.
+LOG_FLUSH_INTERVAL_S = 0.1
+
+# Capture records have a fixed schema, so they are rendered straight to bytes in
+# the same layout json.dumps produces. %a of a float is its repr, as in JSON.
+LOG_LINE = (
+    b'{"ts": %a, "direction": "%s", "len": %d, "src": "%s", "dst": "%s", '
+    b'"hex": "%s", "delay_ms": %a}\n'
+)
+LOG_LINE_NO_HEX = (
+    b'{"ts": %a, "direction": "%s", "len": %d, "src": "%s", "dst": "%s", '
+    b'"delay_ms": %a}\n'
+)
+
+
+def addr_to_string(addr: tuple) -> str:
+    # IPv6 socket addresses carry flowinfo and scope_id after host and port.
+    host, port = addr[:2]
     return f"[{host}]:{port}" if ":" in host else f"{host}:{port}"
 
 
+# Direction indices into the per-direction state slots.
+CLIENT_TO_SERVER = 0
+SERVER_TO_CLIENT = 1
+DIRECTIONS = ("client_to_server", "server_to_client")
+
+
 class SortedDelayModel:
     """
     Samples delays from a sorted pool to avoid natural reordering while matching jitter.
@@ -63,40 +74,51 @@ class SortedDelayModel:
         self.rng = random.Random(seed)
         self.stride = self.pool_size / float(self.expected_packets)
         self._generate_pool()
-        self.state: Dict[str, Dict[str, float]] = {}
+        # Per-direction pool cursor, drawn lazily on first use.
+        self.float_index: List[Optional[float]] = [None, None]
+        if self.jitter_ms <= 0:
+            # Every pool entry is the same value; skip the cursor entirely.
+            self.sample = self._sample_constant
 
     def _generate_pool(self) -> None:
         """Generate a sorted delay pool from the configured distribution."""
-        delays = []
-        for _ in range(self.pool_size):
-            if self.jitter_ms <= 0:
-                jitter = 0.0
-            elif self.dist == "uniform":
-                jitter = self.rng.uniform(-self.jitter_ms, self.jitter_ms)
-            else:
-                jitter = self.rng.gauss(0.0, self.jitter_ms)
-            delays.append(max(0.0, self.base_ms + jitter))
+        base_ms = self.base_ms
+        if self.jitter_ms <= 0:
+            self.sorted_pool = [max(0.0, base_ms)] * self.pool_size
+            return
+        if self.dist == "uniform":
+            draw, low, high = self.rng.uniform, -self.jitter_ms, self.jitter_ms
+        else:
+            draw, low, high = self.rng.gauss, 0.0, self.jitter_ms
+        delays = [base_ms + draw(low, high) for _ in range(self.pool_size)]
         delays.sort()
+        # Negative samples sort to the front; clamp that prefix to zero.
+        negatives = bisect.bisect_left(delays, 0.0)
+        delays[:negatives] = [0.0] * negatives
         self.sorted_pool = delays
 
-    def _get_state(self, direction: str) -> Dict[str, float]:
-        if direction not in self.state:
+    def sample(self, dir_idx: int) -> float:
+        """Sample a delay for the given direction index."""
+        float_index = self.float_index[dir_idx]
+        if float_index is None:
             # Start from a random offset so both directions draw the full distribution.
-            self.state[direction] = {"float_index": self.rng.random() * self.pool_size}
-        return self.state[direction]
+            float_index = self.rng.random() * self.pool_size
+        idx = int(float_index)
+        if idx >= self.pool_size:
+            # Past the end of the pool: wrap, regenerating on an exact lap.
+            idx %= self.pool_size
+            if idx == 0:
+                self._generate_pool()
+                float_index = 0.0
+
+        self.float_index[dir_idx] = float_index + self.stride
+        return self.sorted_pool[idx]
 
-    def sample(self, direction: str) -> float:
-        """Sample a delay for the given direction."""
-        state = self._get_state(direction)
-        idx = int(state["float_index"]) % self.pool_size
-        if idx == 0 and state["float_index"] >= self.pool_size:
-            self._generate_pool()
-            state["float_index"] = 0.0
-            idx = 0
+    def _sample_constant(self, dir_idx: int) -> float:
+        return self.sorted_pool[0]
 
-        delay_ms = self.sorted_pool[idx]
-        state["float_index"] += self.stride
-        return delay_ms
+
+Entry = Tuple[float, float, bytes, Tuple[str, int], Tuple[str, int]]
 
 
 class ReorderController:
@@ -116,130 +138,162 @@ class ReorderController:
         self.interval = (
             int(round(1.0 / self.reorder_rate)) if self.reorder_rate > 0 else 0
         )
-        self.state: Dict[str, Dict[str, object]] = {}
-        self.stats = {
-            "client_to_server": {"total": 0, "reordered": 0},
-            "server_to_client": {"total": 0, "reordered": 0},
-        }
-
-    def _get_state(self, direction: str) -> Dict[str, object]:
-        if direction not in self.state:
-            self.state[direction] = {
-                "floor": 0.0,
-                "prev": None,
-                "count": 0,
-                "last_recv": 0.0,
-            }
-        return self.state[direction]
+        self.floor = [0.0, 0.0]
+        # The packet held back for a possible swap, one field per list.
+        self.has_prev = [False, False]
+        self.prev_send_at = [0.0, 0.0]
+        self.prev_delay_ms = [0.0, 0.0]
+        self.prev_data: List[Optional[bytes]] = [None, None]
+        self.prev_src: List[Optional[Tuple[str, int]]] = [None, None]
+        self.prev_dst: List[Optional[Tuple[str, int]]] = [None, None]
+        # Packets seen per direction; doubles as the "total" reorder statistic.
+        self.count = [0, 0]
+        self.last_recv = [0.0, 0.0]
+        self.reordered = [0, 0]
+        if self.interval == 0:
+            # Nothing is ever held back without reordering, so bind the
+            # straight-line paths once instead of branching per packet.
+            self.process = self._process_in_order
+            self.poll_idle = self._poll_nothing
 
     def process(
         self,
-        direction: str,
+        dir_idx: int,
         recv_time: float,
         natural_delay_ms: float,
         data: bytes,
         src: Tuple[str, int],
         dst: Tuple[str, int],
-    ) -> List[Tuple[float, float, bytes, Tuple[str, int], Tuple[str, int]]]:
+    ) -> List[Entry]:
         """
         Process a packet and return scheduled send entries as
         (send_at, natural_delay_ms, data, src, dst).
         """
-        state = self._get_state(direction)
-        state["count"] += 1
-        self.stats[direction]["total"] += 1
+        count = self.count[dir_idx] + 1
+        self.count[dir_idx] = count
 
-        floor = state["floor"]  # type: float
-        prev = state["prev"]
-        state["last_recv"] = recv_time
+        floor = self.floor[dir_idx]
+        self.last_recv[dir_idx] = recv_time
 
         natural_send_at = recv_time + (natural_delay_ms / 1000.0)
         send_at = natural_send_at if natural_send_at >= floor else floor + self.min_gap_s
 
-        if self.interval == 0:
-            state["prev"] = None
-            state["floor"] = send_at
-            return [(send_at, natural_delay_ms, data, src, dst)]
-
         # First packet: just stash and wait for the next one.
-        if prev is None:
-            state["prev"] = (send_at, natural_delay_ms, data, src, dst)
+        if not self.has_prev[dir_idx]:
+            self._hold(dir_idx, send_at, natural_delay_ms, data, src, dst)
             return []
 
-        prev_send_at, prev_delay_ms, prev_data, prev_src, prev_dst = prev
-        should_reorder = self.interval > 0 and state["count"] % self.interval == 0
+        prev_send_at = self.prev_send_at[dir_idx]
+        prev_delay_ms = self.prev_delay_ms[dir_idx]
+        prev_data = self.prev_data[dir_idx]
+        prev_src = self.prev_src[dir_idx]
+        prev_dst = self.prev_dst[dir_idx]
 
-        if should_reorder:
+        if count % self.interval == 0:
             first_entry = (send_at, natural_delay_ms, data, src, dst)
             second_send_at = max(send_at + self.min_gap_s, prev_send_at)
             second_entry = (second_send_at, prev_delay_ms, prev_data, prev_src, prev_dst)
-            state["prev"] = None
-            state["floor"] = second_send_at
-            self.stats[direction]["reordered"] += 1
+            self.has_prev[dir_idx] = False
+            self.floor[dir_idx] = second_send_at
+            self.reordered[dir_idx] += 1
             return [first_entry, second_entry]
 
         # Normal case: send the previous packet now and keep the current one queued.
-        scheduled_prev = max(prev_send_at, floor)
-        state["floor"] = scheduled_prev
-        state["prev"] = (send_at, natural_delay_ms, data, src, dst)
+        scheduled_prev = prev_send_at if prev_send_at >= floor else floor
+        self.floor[dir_idx] = scheduled_prev
+        self.prev_send_at[dir_idx] = send_at
+        self.prev_delay_ms[dir_idx] = natural_delay_ms
+        self.prev_data[dir_idx] = data
+        self.prev_src[dir_idx] = src
+        self.prev_dst[dir_idx] = dst
         return [(scheduled_prev, prev_delay_ms, prev_data, prev_src, prev_dst)]
 
-    def flush(
-        self, direction: str
-    ) -> List[Tuple[float, float, bytes, Tuple[str, int], Tuple[str, int]]]:
+    def _hold(
+        self,
+        dir_idx: int,
+        send_at: float,
+        natural_delay_ms: float,
+        data: bytes,
+        src: Tuple[str, int],
+        dst: Tuple[str, int],
+    ) -> None:
+        self.has_prev[dir_idx] = True
+        self.prev_send_at[dir_idx] = send_at
+        self.prev_delay_ms[dir_idx] = natural_delay_ms
+        self.prev_data[dir_idx] = data
+        self.prev_src[dir_idx] = src
+        self.prev_dst[dir_idx] = dst
+
+    def _take_prev(self, dir_idx: int, send_at: float) -> Entry:
+        """Emit the held packet at send_at, which also becomes the new floor."""
+        self.has_prev[dir_idx] = False
+        self.floor[dir_idx] = send_at
+        return (
+            send_at,
+            self.prev_delay_ms[dir_idx],
+            self.prev_data[dir_idx],
+            self.prev_src[dir_idx],
+            self.prev_dst[dir_idx],
+        )
+
+    def _process_in_order(
+        self,
+        dir_idx: int,
+        recv_time: float,
+        natural_delay_ms: float,
+        data: bytes,
+        src: Tuple[str, int],
+        dst: Tuple[str, int],
+    ) -> List[Entry]:
+        """process() for reorder_rate == 0: every packet is scheduled immediately."""
+        self.count[dir_idx] += 1
+        self.last_recv[dir_idx] = recv_time
+
+        floor = self.floor[dir_idx]
+        send_at = recv_time + (natural_delay_ms / 1000.0)
+        if send_at < floor:
+            send_at = floor + self.min_gap_s
+        self.floor[dir_idx] = send_at
+        return [(send_at, natural_delay_ms, data, src, dst)]
+
+    def _poll_nothing(self, now: float) -> Tuple[List[Tuple[int, Entry]], Optional[float]]:
+        return [], None
+
+    def _release(self, dir_idx: int) -> Entry:
+        return self._take_prev(dir_idx, max(self.prev_send_at[dir_idx], self.floor[dir_idx]))
+
+    def flush(self, dir_idx: int) -> List[Entry]:
         """Flush any held packet at shutdown."""
-        state = self._get_state(direction)
-        prev = state["prev"]
-        if prev is None:
+        if not self.has_prev[dir_idx]:
             return []
-        state["prev"] = None
-        send_at, delay_ms, data, src, dst = prev
-        send_at = max(send_at, state["floor"])
-        state["floor"] = send_at
-        return [(send_at, delay_ms, data, src, dst)]
-
-    def release_idle(
-        self, now: float
-    ) -> List[Tuple[str, Tuple[float, float, bytes, Tuple[str, int], Tuple[str, int]]]]:
+        return [self._release(dir_idx)]
+
+    def poll_idle(self, now: float) -> Tuple[List[Tuple[int, Entry]], Optional[float]]:
         """
-        Release any pending previous packet if we've been idle for too long.
-        Returns a list of (direction, entry) where entry matches the process() return tuple.
+        Release any held packet that has been idle for too long, in the same pass
+        that finds when the next still-held packet will need releasing.
+        Returns (entries, deadline): entries are (dir_idx, entry) pairs matching the
+        process() return tuple, and deadline is None when nothing is held.
         """
-        entries: List[
-            Tuple[str, Tuple[float, float, bytes, Tuple[str, int], Tuple[str, int]]]
-        ] = []
-        for direction, state in self.state.items():
-            prev = state.get("prev")
-            last_recv = state.get("last_recv", 0.0)
-            if prev is None:
-                continue
-            if now - last_recv < self.idle_timeout_s:
-                continue
-            send_at, delay_ms, data, src, dst = prev
-            send_at = max(send_at, state["floor"])
-            state["floor"] = send_at
-            state["prev"] = None
-            entries.append((direction, (send_at, delay_ms, data, src, dst)))
-        return entries
-
-    def next_idle_deadline(self) -> Optional[float]:
-        """Return the earliest time at which we should flush an idle packet."""
+        entries: List[Tuple[int, Entry]] = []
         deadline: Optional[float] = None
-        for state in self.state.values():
-            prev = state.get("prev")
-            last_recv = state.get("last_recv", 0.0)
-            if prev is None:
+        for dir_idx in (CLIENT_TO_SERVER, SERVER_TO_CLIENT):
+            if not self.has_prev[dir_idx]:
+                continue
+            last_recv = self.last_recv[dir_idx]
+            if now - last_recv >= self.idle_timeout_s:
+                entries.append((dir_idx, self._release(dir_idx)))
                 continue
             candidate = last_recv + self.idle_timeout_s
             if deadline is None or candidate < deadline:
                 deadline = candidate
-        return deadline
+        return entries, deadline
 
     def get_stats(self) -> Dict[str, Dict[str, float]]:
         result = {}
-        for direction, s in self.stats.items():
-            total = s["total"]
-            reordered = s["reordered"]
+        for dir_idx, direction in enumerate(DIRECTIONS):
+            total = self.count[dir_idx]
+            reordered = self.reordered[dir_idx]
             result[direction] = {
                 "total": total,
                 "reordered": reordered,
@@ -258,6 +312,12 @@ def main() -> int:
     parser.add_argument("--log", default="-", help="Log file path (default: stdout)")
     parser.add_argument("--max-packets", type=int, default=0, help="Stop after N packets")
     parser.add_argument("--seed", type=int, default=None, help="Random seed")
+    parser.add_argument(
+        "--no-log-hex",
+        dest="log_hex",
+        action="store_false",
+        help="Omit the payload hex dump from log entries",
+    )
 
     parser.add_argument("--delay-ms", type=float, default=0.0, help="Base delay (ms)")
     parser.add_argument("--jitter-ms", type=float, default=0.0, help="Jitter std dev (ms)")
@@ -296,8 +356,29 @@ def main() -> int:
     family = socket.AF_INET6 if ":" in listen[0] else socket.AF_INET
     sock = socket.socket(family, socket.SOCK_DGRAM)
     sock.bind(listen)
-
-    log_fp = sys.stdout if args.log == "-" else open(args.log, "w", encoding="utf-8")
+    receiver = BatchReceiver(sock)
+    # Client-to-server traffic leaves from its own socket connected to the upstream,
+    # so the kernel skips per-packet destination handling and replies arrive
+    # pre-filtered. Replies to clients still go out from the listen socket.
+    upstream_family = socket.AF_INET6 if ":" in upstream[0] else socket.AF_INET
+    upstream_sock = socket.socket(upstream_family, socket.SOCK_DGRAM)
+    upstream_sock.connect(upstream)
+    upstream_receiver = BatchReceiver(upstream_sock)
+
+    log_fp = sys.stdout.buffer if args.log == "-" else open(args.log, "wb", buffering=1 << 20)
+    log_hex = args.log_hex
+    # Monotonic deadline for the next flush, or None when nothing is buffered.
+    flush_at: Optional[float] = None
+    # The proxy sees one upstream and a handful of clients, so format each once.
+    addr_strings: Dict[tuple, bytes] = {}
+
+    def format_addr(addr: tuple) -> bytes:
+        text = addr_strings.get(addr)
+        if text is None:
+            text = addr_strings[addr] = addr_to_string(addr).encode("ascii")
+        return text
+
+    direction_names = tuple(name.encode("ascii") for name in DIRECTIONS)
 
     delay_model = SortedDelayModel(
         base_ms=args.delay_ms,
@@ -311,32 +392,61 @@ def main() -> int:
 
     last_client: Optional[Tuple[str, int]] = None
     packet_count = 0
-    pending: List[Tuple[float, int, bytes, Tuple[str, int]]] = []
-    push_seq = 0
-
-    def log_and_enqueue(
-        direction: str,
-        entry: Tuple[float, float, bytes, Tuple[str, int], Tuple[str, int]],
-    ) -> None:
-        nonlocal push_seq
+    # One FIFO per direction: the reorder controller never schedules a packet
+    # earlier than the previous one it emitted for that direction, so each queue
+    # stays sorted by send_at without a heap.
+    pending: Tuple[Deque[Tuple[float, bytes, Tuple[str, int]]], ...] = (deque(), deque())
+
+    # Hot-loop callables bound once rather than looked up per packet.
+    monotonic = time.monotonic
+    wall_time = time.time
+    hexlify = binascii.hexlify
+    log_write = log_fp.write
+    sendto = sock.sendto
+    upstream_send = upstream_sock.send
+    receive = receiver.receive
+    receive_upstream = upstream_receiver.receive
+    sample = delay_model.sample
+    process = reorder_ctrl.process
+    poll_idle = reorder_ctrl.poll_idle
+    max_packets = args.max_packets
+    select_socks = [sock, upstream_sock]
+
+    def send_upstream(data: bytes, _dst: Tuple[str, int]) -> None:
+        try:
+            upstream_send(data)
+        except ConnectionRefusedError:
+            # ICMP port unreachable from an earlier send; UDP has no connection to lose.
+            pass
+
+    senders = tuple(zip(pending, (send_upstream, sendto)))
+
+    def log_and_enqueue(dir_idx: int, entry: Entry) -> None:
+        nonlocal flush_at
         send_at, natural_delay_ms, pkt_data, pkt_src, pkt_dst = entry
-        log_fp.write(
-            json.dumps(
-                {
-                    "ts": time.time(),
-                    "direction": direction,
-                    "len": len(pkt_data),
-                    "src": addr_to_string(pkt_src),
-                    "dst": addr_to_string(pkt_dst),
-                    "hex": pkt_data.hex().upper(),
-                    "delay_ms": natural_delay_ms,
-                }
+        if log_hex:
+            line = LOG_LINE % (
+                wall_time(),
+                direction_names[dir_idx],
+                len(pkt_data),
+                format_addr(pkt_src),
+                format_addr(pkt_dst),
+                hexlify(pkt_data).upper(),
+                natural_delay_ms,
             )
-            + "\n"
-        )
-        log_fp.flush()
-        push_seq += 1
-        heapq.heappush(pending, (send_at, push_seq, pkt_data, pkt_dst))
+        else:
+            line = LOG_LINE_NO_HEX % (
+                wall_time(),
+                direction_names[dir_idx],
+                len(pkt_data),
+                format_addr(pkt_src),
+                format_addr(pkt_dst),
+                natural_delay_ms,
+            )
+        log_write(line)
+        if flush_at is None:
+            flush_at = monotonic() + LOG_FLUSH_INTERVAL_S
+        pending[dir_idx].append((send_at, pkt_data, pkt_dst))
 
     print(f"UDP proxy listening on {addr_to_string(listen)}", file=sys.stderr)
     print(f"  Upstream: {addr_to_string(upstream)}", file=sys.stderr)
@@ -346,67 +456,93 @@ def main() -> int:
     )
     print(f"  Target reorder rate: {reorder_rate * 100:.4f}%", file=sys.stderr)
 
+    # Harnesses stop the proxy with SIGTERM; take the KeyboardInterrupt path so
+    # buffered log lines are written out before exit.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
     try:
         while True:
-            now = time.monotonic()
+            now = monotonic()
             # Release any pending packets that have been waiting without traffic.
-            for direction, entry in reorder_ctrl.release_idle(now):
-                log_and_enqueue(direction, entry)
-
-            while pending and pending[0][0] <= now:
-                _, _, data, dst = heapq.heappop(pending)
-                sock.sendto(data, dst)
-
-            timeout = max(0.0, pending[0][0] - now) if pending else None
-            idle_deadline = reorder_ctrl.next_idle_deadline()
+            idle_entries, idle_deadline = poll_idle(now)
+            for dir_idx, entry in idle_entries:
+                log_and_enqueue(dir_idx, entry)
+
+            timeout = None
+            for queue, send in senders:
+                while queue and queue[0][0] <= now:
+                    _, data, dst = queue.popleft()
+                    send(data, dst)
+                if queue:
+                    wait = max(0.0, queue[0][0] - now)
+                    timeout = wait if timeout is None else min(timeout, wait)
             if idle_deadline is not None:
                 idle_timeout = max(0.0, idle_deadline - now)
                 timeout = idle_timeout if timeout is None else min(timeout, idle_timeout)
-            ready, _, _ = select([sock], [], [], timeout)
+            # Buffered log lines go out at most LOG_FLUSH_INTERVAL_S late, so
+            # harnesses tailing the capture still see packets while we run.
+            if flush_at is not None:
+                if now >= flush_at:
+                    log_fp.flush()
+                    flush_at = None
+                else:
+                    flush_timeout = flush_at - now
+                    timeout = flush_timeout if timeout is None else min(timeout, flush_timeout)
+            ready, _, _ = select(select_socks, [], [], timeout)
             if not ready:
                 continue
 
-            data, addr = sock.recvfrom(65535)
-            recv_time = time.monotonic()
-
-            if addr == upstream:
-                direction = "server_to_client"
-                dst = last_client
-            else:
-                direction = "client_to_server"
-                dst = upstream
-                last_client = addr
-
-            if dst is None:
-                continue
-
-            natural_delay_ms = delay_model.sample(direction)
-            scheduled = reorder_ctrl.process(
-                direction, recv_time, natural_delay_ms, data, addr, dst
-            )
-
-            for entry in scheduled:
-                log_and_enqueue(direction, entry)
-
-            packet_count += 1
-            if args.max_packets and packet_count >= args.max_packets:
+            stop = False
+            for ready_sock in ready:
+                if ready_sock is sock:
+                    dir_idx = CLIENT_TO_SERVER
+                    batch = receive()
+                else:
+                    dir_idx = SERVER_TO_CLIENT
+                    try:
+                        batch = receive_upstream()
+                    except ConnectionRefusedError:
+                        batch = []
+                recv_time = monotonic()
+                for data, addr in batch:
+                    if dir_idx == CLIENT_TO_SERVER:
+                        dst = upstream
+                        last_client = addr
+                    else:
+                        dst = last_client
+                        if dst is None:
+                            continue
+
+                    natural_delay_ms = sample(dir_idx)
+                    for entry in process(dir_idx, recv_time, natural_delay_ms, data, addr, dst):
+                        log_and_enqueue(dir_idx, entry)
+
+                    packet_count += 1
+                    if max_packets and packet_count >= max_packets:
+                        stop = True
+                        break
+                if stop:
+                    break
+            if stop:
                 break
 
     except KeyboardInterrupt:
         pass
     finally:
         # Flush any held packet.
-        for d in ("client_to_server", "server_to_client"):
-            for entry in reorder_ctrl.flush(d):
-                log_and_enqueue(d, entry)
+        for dir_idx in (CLIENT_TO_SERVER, SERVER_TO_CLIENT):
+            for entry in reorder_ctrl.flush(dir_idx):
+                log_and_enqueue(dir_idx, entry)
 
-        # Drain pending queue.
-        while pending:
-            send_at, _, data, dst = heapq.heappop(pending)
+        # Drain pending queues in send_at order.
+        for send_at, data, dst in heapq.merge(*pending, key=itemgetter(0)):
             wait = send_at - time.monotonic()
             if wait > 0:
                 time.sleep(wait)
-            sock.sendto(data, dst)
+            if dst == upstream:
+                send_upstream(data, dst)
+            else:
+                sendto(data, dst)
 
         stats = reorder_ctrl.get_stats()
         print(f"\n=== Reorder Statistics ===", file=sys.stderr)
@@ -416,8 +552,11 @@ def main() -> int:
                 file=sys.stderr,
             )
 
-        if log_fp is not sys.stdout:
+        if log_fp is sys.stdout.buffer:
+            log_fp.flush()
+        else:
             log_fp.close()
+        upstream_sock.close()
         sock.close()
 
     return 0